@@ -41,22 +41,85 @@ On a high level, these are the steps LEET uses to execute a job:
 import threading
 import contextlib
 import concurrent.futures
+import collections
+import ast
 import enum
-import queue
+import functools
 import logging
 import datetime
+import heapq
+import itertools
 import os
+import sys
 import importlib
+import importlib.util
 import time
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.schedulers.base import STATE_STOPPED as APS_SCHED_STOPPED
-
-from .base import LeetJob, LeetSearchRequest, LeetJobStatus
+from .base import LeetJob, LeetSearchRequest, LeetJobStatus, _Trig
 from .errors import  LeetError, LeetSessionError, LeetPluginError
+#the parent package of the plugins is a hard dependency of '_load_plugins',
+#importing it here pays the import-lock round trip exactly once
+from . import plugins as _plugins_package
 
 _MOD_LOGGER = logging.getLogger(__name__)
 
+#a job on any of these status is finished and can't be cancelled anymore
+_TERMINAL_JOB_STATUS = frozenset((LeetJobStatus.COMPLETED, LeetJobStatus.CANCELLED, LeetJobStatus.ERROR))
+
+#one line of the 'job_status' report. A namedtuple is cheaper to build than
+#a dict per job and the UI polls this frequently. The status field holds
+#the status name, as LeetJobStatus is an IntEnum and would render as a
+#bare number
+JobStatusRow = collections.namedtuple("JobStatusRow", ("id", "hostname", "plugin", "status"))
+
+#the plugin directory lives next to this file, resolved once at import time
+_PLUGIN_ABSPATH = os.path.join(os.path.dirname(__file__), "plugins")
+
+#caches the result of '_load_plugins', keyed by a signature of the plugin
+#directory (filenames and mtimes), so unchanged reloads are free
+_PLUGIN_CACHE = {"sig" : None, "files" : {}, "names" : {}, "modules" : {}, "plugins" : {}}
+
+def _read_plugin_name(file_path):
+    """Finds the plugin name ('LEET_PG_NAME' on the 'LeetPlugin' class)
+    without importing the module, by walking the parsed source.
+    """
+    with open(file_path, "rb") as source:
+        tree = ast.parse(source.read())
+
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == "LeetPlugin":
+            for statement in node.body:
+                if isinstance(statement, ast.Assign):
+                    for target in statement.targets:
+                        if isinstance(target, ast.Name) and target.id == "LEET_PG_NAME":
+                            return statement.value.value
+
+    return None
+
+def _import_plugin_module(fqname):
+    """Imports a plugin module straight from its file.
+
+    The plugin location is known, so building the spec directly skips the
+    finder/path-hook machinery of a regular import. The module is registered
+    in sys.modules the same way the import system does, keeping
+    'importlib.reload' and the cache cleanup working.
+    """
+    mod = sys.modules.get(fqname)
+    if mod is not None:
+        return mod
+
+    file_path = os.path.join(_PLUGIN_ABSPATH, fqname.rsplit(".", 1)[1] + ".py")
+    spec = importlib.util.spec_from_file_location(fqname, file_path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[fqname] = mod
+    try:
+        spec.loader.exec_module(mod)
+    except BaseException:
+        sys.modules.pop(fqname, None)
+        raise
+
+    return mod
+
 def _load_plugins(plugin_dir="plugins"):
     #TODO replace for a more robust system
     """Load the plugins dynamically.
@@ -64,26 +127,119 @@ def _load_plugins(plugin_dir="plugins"):
     This function will parse the folder defined in '_PLUGIN_DIR' and do basic
     check to see if everything is present and plugin is defined. All plugins
     MUST NOT start with '_' and MUST end with '.py'.
-    """
-    plugins = {}
-    absolute_path = os.path.join(os.path.dirname(__file__), plugin_dir)
 
+    The modules are NOT imported here. The plugin names are read from the
+    source (see '_read_plugin_name') and the returned dict maps each name
+    either to the already imported module or to the module name, which
+    'Leet.get_plugin' imports on the first request. Files that didn't change
+    since the last call reuse the previous entry.
+    """
+    if plugin_dir == "plugins":
+        absolute_path = _PLUGIN_ABSPATH
+    else:
+        absolute_path = os.path.join(os.path.dirname(__file__), plugin_dir)
+
+    #the name checks come first and the suffix is trusted, so entries like
+    #'__pycache__' are discarded on the string test alone and only actual
+    #plugin candidates pay the stat for their mtime
     with os.scandir(absolute_path) as directory:
-        found_plugins = [entry.name for entry in directory if entry.is_file() and not entry.name.startswith("_") and entry.name.endswith(".py")]
+        found_plugins = sorted((entry.name, entry.stat().st_mtime_ns) for entry in directory
+                               if entry.name.endswith(".py")
+                               and not entry.name.startswith("_"))
     if not found_plugins:
         #TODO better error information
         print("No plugin found. Stopping things.")
-    _MOD_LOGGER.debug("Plugins found: %s", found_plugins)
-    plugin_names = map(lambda fname: "." + os.path.splitext(fname)[0], found_plugins)
-    #importlib.import_module(plugin_dir, package="leet") #import the parent module
-    importlib.import_module("leet.plugins") #import the parent module
-    #import the plugins
-    for plugin in plugin_names:
-        mod = importlib.import_module(plugin, package="leet." + plugin_dir)
-        plugins[mod.LeetPlugin.LEET_PG_NAME] = mod
+        return {}
+
+    sig = tuple(found_plugins)
+    if sig == _PLUGIN_CACHE["sig"]:
+        _MOD_LOGGER.debug("Plugin directory unchanged, reusing loaded plugins.")
+        return _PLUGIN_CACHE["plugins"]
+    _MOD_LOGGER.debug("Plugins found: %s", [name for name, mtime in found_plugins])
+
+    files, names, modules, plugins = {}, {}, {}, {}
+    for fname, mtime in found_plugins:
+        fqname = "leet." + plugin_dir + "." + fname[:-3]
+        if _PLUGIN_CACHE["files"].get(fname) == mtime:
+            #unchanged, reuse whatever we had (module or deferred name)
+            name = _PLUGIN_CACHE["names"][fname]
+            mod = _PLUGIN_CACHE["modules"][fname]
+        elif fqname in sys.modules:
+            #the file changed after being imported, reload it now
+            mod = importlib.reload(sys.modules[fqname])
+            name = mod.LeetPlugin.LEET_PG_NAME
+        else:
+            #new file, the import is paid by the first 'get_plugin' call
+            name = _read_plugin_name(os.path.join(absolute_path, fname))
+            mod = fqname
+        files[fname] = mtime
+        names[fname] = name
+        modules[fname] = mod
+        plugins[name] = mod
+
+    #files removed from the directory also leave sys.modules, so a later
+    #re-add gets a fresh import instead of the stale module
+    for fname in _PLUGIN_CACHE["files"].keys() - files.keys():
+        sys.modules.pop("leet." + plugin_dir + "." + fname[:-3], None)
+
+    _PLUGIN_CACHE["sig"] = sig
+    _PLUGIN_CACHE["files"] = files
+    _PLUGIN_CACHE["names"] = names
+    _PLUGIN_CACHE["modules"] = modules
+    _PLUGIN_CACHE["plugins"] = plugins
 
     return plugins
 
+class _Scheduler(threading.Thread):
+    """Internal thread that fires delayed callbacks.
+
+    A general purpose scheduler (like APScheduler) serializes a trigger,
+    takes the scheduler lock and wakes its dispatcher for every added job,
+    which is heavy for what is effectively "call me again in N seconds"
+    repeated for every offline machine and pending search. This keeps a
+    heap of (deadline, callback, payload) instead and fires each callback
+    when its deadline is due.
+    """
+
+    def __init__(self):
+        super().__init__(name="Thr-LeetScheduler")
+        self._heap = []
+        #breaks deadline ties, so the payloads are never compared
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+
+    def schedule(self, delay, callback, payload):
+        """Schedules 'callback(payload)' to run 'delay' seconds from now."""
+        deadline = time.monotonic() + delay
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), callback, payload))
+            self._cond.notify()
+
+    def shutdown(self):
+        """Stops the thread. Entries still on the heap are discarded."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self.ident is not None:
+            self.join()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._heap:
+                        timeout = self._heap[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._cond.wait(timeout)
+                    else:
+                        self._cond.wait()
+                if self._stopping:
+                    break
+                deadline, _, callback, payload = heapq.heappop(self._heap)
+            callback(payload)
+
 class _LTControl(enum.Enum):
     """ An internal control flag to tell what the thread handling Leet should
     do. This way all interaction happens via the internal control queue, making
@@ -96,11 +252,15 @@ class _LTControl(enum.Enum):
     SEARCH_BACKEND             | LeetSearchRequest
     SEARCH_READY               | LeetSearchRequest
     JOB_DONE                   | LeetJob
+    CANCEL_JOB                 | LeetJob
+    CANCEL_ALL                 | None
     """
     STOP = 0x0
     SEARCH_BACKEND = 0x1
     SEARCH_READY = 0x2
     JOB_DONE = 0x3
+    CANCEL_JOB = 0x4
+    CANCEL_ALL = 0x5
 
 class Leet(threading.Thread):
     """This is the main class from LEET. It starts all control needs and
@@ -120,54 +280,90 @@ class Leet(threading.Thread):
         Args:
             backend_list (list of LeetBackend*): A list of the backend instances.
             job_notification (Queue?): A queue or something similar that has support
-                for the method 'put(LeetJob)' and is thread safe. This is how the
-                LEET returns data to the upper levels
+                for the method 'put(list of LeetJob)' and is thread safe. This
+                is how the LEET returns data to the upper levels. Jobs finished
+                close together are delivered as a single list
         """
         super().__init__(name="Thr-Leet")
         self.ready = False
         self._backend_list = {}
-        self._queue = queue.SimpleQueue()
+        #set for real by _start_threads, once the backends are up
+        self._backends = ()
+        self._backend_quantity = 0
+        #control channel: a deque (atomic append/popleft under the GIL) plus
+        #an event to wake the consumer, so producers don't take a queue lock
+        self._queue = collections.deque()
+        self._queue_event = threading.Event()
+        #set by 'shutdown' so the main loop can leave without processing
+        #whatever is still queued
+        self._shutting_down = threading.Event()
         self._plugins = None
+        self._plugin_names = ()
 
         self._job_list_lock = threading.Lock()
-        self._job_list = []
-
-        self._search_timeout = datetime.timedelta(seconds=30)
-        self._sched_search = BackgroundScheduler()
-
-        self._machine_update_interval = datetime.timedelta(seconds=20)
-        self._sched_machine = BackgroundScheduler()
-
-        self._job_expiry_timeout = datetime.timedelta(days=3)
+        #maps job.id -> LeetJob, so lookup and removal are O(1)
+        self._job_list = {}
+        #immutable snapshot of the jobs, rebuilt whenever the list changes.
+        #Readers just grab the current tuple, no lock involved
+        self._job_view = ()
+
+        #timeouts in seconds; all the deadline math runs on the monotonic
+        #clock, so wall-clock jumps don't disturb the scheduling
+        self._search_timeout = 30.0
+        self._machine_update_interval = 20.0
+        self._job_expiry_timeout = 3 * 86400.0
+        #a single thread handles both the machine polling and the search
+        #expiry timers
+        self._sched = _Scheduler()
+
+        #jobs waiting for their machine to come online, grouped by backend
+        #name so each backend refreshes a whole batch with one server query
+        self._offline_jobs = {}
+        self._offline_lock = threading.Lock()
+
+        #operator overrides for the session pool sizes, keyed by backend name
+        self._worker_overrides = {}
+        #per-backend caps on concurrent sessions, keyed by backend name
+        self._session_limits = {}
+        #the shared session pool, created by _start_threads
+        self._session_pool = None
 
         self._job_notification = job_notification
 
+        #maps each control command to its handler, so the main loop dispatches
+        #with a single dict lookup instead of a chain of comparisons
+        self._dispatch = {
+            _LTControl.SEARCH_BACKEND : self._handle_search_backend,
+            _LTControl.SEARCH_READY : self._search_ready,
+            _LTControl.CANCEL_JOB : self._handle_cancel_job,
+            _LTControl.CANCEL_ALL : self._handle_cancel_all,
+        }
+
         self._conf_backend(backend_list)
         self.reload_plugins()
 
     @property
     def job_status(self):
-        """A list of dictionaries with each job, its status and basic information"""
-        status = []
-        #acquire lock as jobs might be completed while processing
-        with self._job_list_lock:
-            for job in self._job_list:
-                status.append({"id" : job.id,
-                               "hostname" : job.machine.hostname,
-                               "plugin": job.plugin_instance.LEET_PG_NAME,
-                               "status" : job.status})
-
-        return status
+        """A list of 'JobStatusRow' with each job, its status and basic
+        information"""
+        #reads the published snapshot, so a status query never blocks the
+        #threads that are adding or removing jobs
+        return [JobStatusRow(job.id, job.machine.hostname, job.plugin_instance.LEET_PG_NAME, job.status.name)
+                for job in self._job_view]
 
     @property
     def plugin_list(self):
-        """A list of plugin names"""
-        return [name for name in self._plugins]
+        """A tuple of plugin names"""
+        return self._plugin_names
 
     def reload_plugins(self):
         """Forces a plugin reload"""
         _MOD_LOGGER.debug("(Re)loading plugins.")
         self._plugins = _load_plugins()
+        #cached here, as the names can change only on a reload. The classes
+        #are resolved on first use, so deferred modules stay unloaded
+        self._plugin_names = tuple(self._plugins)
+        self._plugin_classes = {}
 
     def get_plugin(self, plugin_name):
         """Returns an instance of the plugin based on the name.
@@ -181,7 +377,34 @@ class Leet(threading.Thread):
         Raises:
             KeyError: If the plugin name doesn't exists
         """
-        return self._plugins[plugin_name].LeetPlugin()
+        try:
+            return self._plugin_classes[plugin_name]()
+        except KeyError:
+            pass
+
+        mod = self._plugins[plugin_name]
+        if isinstance(mod, str):
+            #first request for this plugin, import it for real
+            mod = _import_plugin_module(mod)
+            self._plugins[plugin_name] = mod
+        #resolving the class once also spares the module attribute lookup
+        #on the next requests
+        self._plugin_classes[plugin_name] = mod.LeetPlugin
+
+        return mod.LeetPlugin()
+
+    def _put_cmd(self, code, value):
+        """Puts a command on the control channel and wakes the main loop.
+
+        Args:
+            code (_LTControl): The control command
+            value: The payload of the command, as documented in '_LTControl'
+        """
+        self._queue.append((code, value))
+        #the is_set check is a plain bool read, so concurrent producers only
+        #fight over the event lock when the main loop actually needs a wake-up
+        if not self._queue_event.is_set():
+            self._queue_event.set()
 
     def notify_search_completed(self, search_request):
         """Notifies a search has been completed by all backends.
@@ -193,52 +416,141 @@ class Leet(threading.Thread):
             search_request (LeetSearchRequest): The search request that has been
                 completed.
         """
-        self._queue.put((_LTControl.SEARCH_READY, search_request))
+        self._put_cmd(_LTControl.SEARCH_READY, search_request)
+
+    def set_backend_workers(self, backend_name, workers):
+        """Overrides the session pool size for a backend.
+
+        Must be called before 'start()'; once the pools exist the value is
+        ignored with a warning.
+
+        Args:
+            backend_name (str): The unique name of the backend
+            workers (int): The number of worker threads for the backend
+        """
+        if self.ready:
+            _MOD_LOGGER.warning("Session pools already created, worker count for '%s' ignored.", backend_name)
+            return
+        self._worker_overrides[backend_name] = workers
+
+    def _session_workers(self, backend):
+        """Number of workers for a backend's session pool. Capped by the
+        machine size, so a big session limit doesn't oversubscribe a small
+        host, unless the operator explicitly overrode it."""
+        default = min(backend.max_sessions, (os.cpu_count() or 1) * 5)
+        return self._worker_overrides.get(backend.backend_name, default)
 
     def _start_threads(self, stack):
         # start the schedulers
         temp_backend = {}
 
-        _MOD_LOGGER.debug("Starting schedulers...")
-        self._sched_machine.start()
-        self._sched_search.start()
+        _MOD_LOGGER.debug("Starting scheduler...")
+        self._sched.start()
         _MOD_LOGGER.debug("Starting backend resources...")
 
+        #one pool serves every backend, so threads left idle by one backend
+        #pick up the work of a busy one. The per-backend session limits are
+        #enforced by semaphores instead of pool sizes
+        #'or 1' keeps the pool constructible when no backend is configured
+        total_workers = sum(self._session_workers(backend) for backend, pool in self._backend_list.values()) or 1
+        session_pool = concurrent.futures.ThreadPoolExecutor(max_workers=total_workers, thread_name_prefix="Thr-sessions")
+        stack.enter_context(session_pool)
+
         for backend, pool in self._backend_list.values():
-            pool = concurrent.futures.ThreadPoolExecutor(max_workers=backend.max_sessions, thread_name_prefix="Thr-" + backend.backend_name + "-sessions")
-            temp_backend[backend.backend_name] = (backend, pool)
-            stack.enter_context(pool)
+            self._session_limits[backend.backend_name] = threading.BoundedSemaphore(backend.max_sessions)
+            temp_backend[backend.backend_name] = (backend, session_pool)
             stack.enter_context(backend)
             _MOD_LOGGER.debug("Finished allocating resources for backend '%s'", backend.backend_name)
 
+        self._session_pool = session_pool
+
         self._backend_list = temp_backend
+        #frozen after this point, so searches iterate a tuple and reuse the
+        #count instead of rebuilding a dict view per request
+        self._backends = tuple(backend for backend, pool in temp_backend.values())
+        self._backend_quantity = len(self._backends)
         self.ready = True
 
+    def _handle_search_backend(self, search_request):
+        """Internal method that sends a search request to all backends and
+        schedules its expiration."""
+        for backend in self._backends:
+            backend.search_machines(search_request)
+        self._sched.schedule(self._search_timeout, self._expire_search, search_request)
+
+    def _handle_jobs_done(self, leet_jobs):
+        """Internal method that removes a batch of finished jobs, taking the
+        lock once, and notifies the application with a single put of the
+        whole list."""
+        with self._job_list_lock:
+            for leet_job in leet_jobs:
+                self._job_list.pop(leet_job.id, None)
+            self._job_view = tuple(self._job_list.values())
+        self._job_notification.put(leet_jobs)
+
+    def _handle_cancel_job(self, leet_job):
+        """Internal method that flags a job as cancelled. The job is removed
+        from processing the next time it is considered for scheduling."""
+        try:
+            leet_job.transition(_Trig.CANCEL)
+            _MOD_LOGGER.debug("Job %s has been cancelled.", leet_job.id)
+        except LeetError:
+            #the job finished between the request and the processing
+            _MOD_LOGGER.debug("Job %s can't be cancelled anymore.", leet_job.id)
+
+    def _handle_cancel_all(self, _):
+        """Internal method that cancels every job still on the list in a
+        single pass on the main thread."""
+        for leet_job in self._job_view:
+            if leet_job.status not in _TERMINAL_JOB_STATUS:
+                self._handle_cancel_job(leet_job)
+
     def run(self):
         """Starts LEET, the threads and backend connections, making LEET ready to be
         interacted with.
         """
         with contextlib.ExitStack() as stack:
             self._start_threads(stack)
-            #TODO this look ugly, redo
-            backend_quantity = len(self._backend_list)
             #main loop
-            while True:
-                code, value = self._queue.get()
-                _MOD_LOGGER.debug("Processing internal command '%s'", code)
-                if code == _LTControl.STOP:
+            stop = False
+            while not stop:
+                #a shutdown request skips any backlog of pending commands,
+                #so closing doesn't wait on a burst of late completions
+                if self._shutting_down.is_set():
                     break
-                elif code == _LTControl.SEARCH_BACKEND:
-                    value.backend_quantity = backend_quantity
-                    for backend, t_pool in self._backend_list.values():
-                        backend.search_machines(value)
-                    next_exec = datetime.datetime.now() + self._search_timeout
-                    self._sched_search.add_job(self._expire_search, 'date', run_date=next_exec, args=[value], id=str(value.id))
-                elif code == _LTControl.SEARCH_READY:
-                    self._search_ready(value)
-                elif code == _LTControl.JOB_DONE:
-                    self._remove_job(value)
-                    self._job_notification.put(value)
+                #waits for the event, then drains whatever is queued, so
+                #bursts are processed as a single batch. The timeout keeps the
+                #thread interruptible for idle work
+                if not self._queue:
+                    if not self._queue_event.wait(timeout=1.0):
+                        continue
+                #clearing before the drain; a producer that appends after it
+                #will set the event again and trigger the next round
+                self._queue_event.clear()
+                commands = []
+                try:
+                    while True:
+                        commands.append(self._queue.popleft())
+                except IndexError:
+                    pass
+                #completions in the same batch are coalesced, so a burst of
+                #finished jobs costs one lock acquisition and one notification
+                done_jobs = []
+                #checked once per batch; skips the per-command logging call
+                #overhead entirely when debug is off
+                log_commands = _MOD_LOGGER.isEnabledFor(logging.DEBUG)
+                for code, value in commands:
+                    if log_commands:
+                        _MOD_LOGGER.debug("Processing internal command '%s'", code)
+                    if code is _LTControl.STOP:
+                        stop = True
+                        break
+                    if code is _LTControl.JOB_DONE:
+                        done_jobs.append(value)
+                    else:
+                        self._dispatch[code](value)
+                if done_jobs:
+                    self._handle_jobs_done(done_jobs)
 
     def _conf_backend(self, backend_list):
         """Links the backend with the Leet class.
@@ -261,29 +573,33 @@ class Leet(threading.Thread):
         Args:
             search_request (LeetSearchRequest): The search that is ready
         """
-        f_machines = set()
+        found_machines = search_request.found_machines
 
-        _MOD_LOGGER.debug("Search finished. Took %s secs.", search_request.end_time - search_request.start_time)
+        #the timedelta is only built if the log is actually emitted
+        if _MOD_LOGGER.isEnabledFor(logging.DEBUG):
+            _MOD_LOGGER.debug("Search finished. Took %s secs.", search_request.end_time - search_request.start_time)
         #TODO solve conflicts
-        for machine in search_request.found_machines:
-            f_machines.add(machine.hostname)
-            _MOD_LOGGER.info("Adding job for machine %s", machine.hostname)
-            self._add_job(LeetJob(machine, search_request.plugin))
-        if len(search_request.hostnames) > len(f_machines):
-            _MOD_LOGGER.info("The following machines were not found and will be ignored: %s", [h for h in search_request.hostnames if h not in f_machines])
-
-    def _add_job(self, leet_job):
-        """Internal method that adds the job to the processing list and
-        to the schedule."""
+        _MOD_LOGGER.info("Adding jobs for %d machines", len(found_machines))
+        self._add_jobs([LeetJob(machine, search_request.plugin) for machine in found_machines])
+        missing = search_request.hostnames - {machine.hostname for machine in found_machines}
+        if missing:
+            _MOD_LOGGER.info("The following machines were not found and will be ignored: %s", sorted(missing))
+
+    def _add_jobs(self, leet_jobs):
+        """Internal method that adds a batch of jobs to the processing list and
+        to the schedule. The lock is taken once for the whole batch and the
+        poller deadlines are staggered, so the connection attempts stay paced
+        without blocking the main loop."""
+        #the semaphore of the backend is stashed on the job, saving the
+        #backend-name lookups on every poll of the machine
+        for leet_job in leet_jobs:
+            leet_job._session_limit = self._session_limits[leet_job.machine.backend_name]
         with self._job_list_lock:
-            self._job_list.append(leet_job)
-            self._sched_machine.add_job(self._is_machine_ready, 'date', args=[leet_job])
-            time.sleep(0.1)
-
-    def _remove_job(self, leet_job):
-        """Removes a job from the job list."""
-        with self._job_list_lock:
-            self._job_list.remove(leet_job)
+            for leet_job in leet_jobs:
+                self._job_list[leet_job.id] = leet_job
+            self._job_view = tuple(self._job_list.values())
+        for i, leet_job in enumerate(leet_jobs):
+            self._sched.schedule(0.1 * i, self._poll_machine, leet_job)
 
     #TODO move this to another place? where?
     def _execute_plugin(self, leet_job):
@@ -303,25 +619,25 @@ class Leet(threading.Thread):
         try:
             with leet_job.machine.connect() as session:
                 _MOD_LOGGER.debug("Session for job %s ready. Starting execution.", leet_job.id)
-                leet_job.executing()
+                leet_job.transition(_Trig.EXECUTING)
                 leet_job.plugin_result = leet_job.plugin_instance.run(session, leet_job.machine)
-                leet_job.completed()
+                leet_job.transition(_Trig.COMPLETED)
                 _MOD_LOGGER.debug("Job %s was successful.", leet_job.id)
-                self._queue.put((_LTControl.JOB_DONE, leet_job))
+                self._put_cmd(_LTControl.JOB_DONE, leet_job)
         except LeetSessionError as e:
             if not e.stop:
                 _MOD_LOGGER.debug("Job %s failed. Error: %s", leet_job.id, str(e))
-                leet_job.pending()
+                leet_job.transition(_Trig.PENDING)
                 _MOD_LOGGER.debug("Rescheduling Job %s", leet_job.id)
                 self._is_machine_ready(leet_job)
             else: #if this is a critial session error, let's remove the job from processing
-                self._queue.put((_LTControl.JOB_DONE, leet_job))
+                self._put_cmd(_LTControl.JOB_DONE, leet_job)
         except LeetPluginError as e:
             _MOD_LOGGER.debug("Job %s failed. Error in plugin execution", leet_job.id)
             _MOD_LOGGER.exception(e)
-            leet_job.error()
+            leet_job.transition(_Trig.ERROR)
             leet_job.plugin_result = [{"error_message": str(e)}]
-            self._queue.put((_LTControl.JOB_DONE, leet_job))
+            self._put_cmd(_LTControl.JOB_DONE, leet_job)
 
     def _handle_errors(self, result):
         """Catch all method registered as a callback for the jobs once they are executed.
@@ -341,6 +657,8 @@ class Leet(threading.Thread):
         if not search_request.ready:
             _MOD_LOGGER.warning("Search %s expired. Running the jobs with what we have", search_request.id)
             #TODO more info on what completed and what expired
+            #an expired search never got its end_time from the backends
+            search_request.end_time = datetime.datetime.utcnow()
             search_request.ready = True
             self.notify_search_completed(search_request)
         else:
@@ -356,30 +674,88 @@ class Leet(threading.Thread):
         Returns:
             (bool): True if it can be rescheduled or False, if not.
         """
-        expiry_time = leet_job.start_time + self._job_expiry_timeout
-        if leet_job.status != LeetJobStatus.CANCELLED and datetime.datetime.utcnow() < expiry_time:
-            return True
-        else:
+        #the status check is a plain attribute read, so cancelled jobs skip
+        #the clock read entirely
+        if leet_job.status == LeetJobStatus.CANCELLED:
             return False
 
+        return time.monotonic() < leet_job.start_monotonic + self._job_expiry_timeout
+
+    def _poll_machine(self, leet_job):
+        """Callback of the scheduler. Pushes the readiness check to the
+        backend's pool, so a slow machine refresh doesn't stall the scheduler."""
+        job = self._session_pool.submit(self._is_machine_ready, leet_job)
+        job.add_done_callback(self._handle_errors)
+
+    def _release_session(self, leet_job, future):
+        """Gives back the session slot of the backend once the plugin
+        execution is over, then runs the normal error handling."""
+        leet_job._session_limit.release()
+        self._handle_errors(future)
+
     def _is_machine_ready(self, leet_job):
-        """Check if the machine is ready to connect. If not, reschedule the
-        job to try again in the time determined by 'self._machine_update_interval'.
+        """Check if the machine is ready to connect. If not, park the job
+        for the next bulk refresh of its backend.
+
+        The machine data is expected to be fresh at this point, coming
+        either from the search that created the job or from the bulk
+        refresh that re-checked it.
         """
-        leet_job.machine.refresh()
         if leet_job.machine.can_connect:
+            #the semaphore caps how many sessions the backend holds at once.
+            #No slot available means every session is busy, so try again
+            #shortly instead of tying up a pool thread waiting
+            if not leet_job._session_limit.acquire(blocking=False):
+                _MOD_LOGGER.debug("No session slot for job %s. Retrying shortly.", leet_job.id)
+                self._sched.schedule(1.0, self._poll_machine, leet_job)
+                return
             _MOD_LOGGER.debug("Machine for job %s is Online. Attempting connection.", leet_job.id)
-            job = self._backend_list[leet_job.machine.backend_name][1].submit(self._execute_plugin, leet_job)
-            job.add_done_callback(self._handle_errors)
+            job = self._session_pool.submit(self._execute_plugin, leet_job)
+            job.add_done_callback(functools.partial(self._release_session, leet_job))
         else:
             if self._can_reschedule_job(leet_job):
-                _MOD_LOGGER.debug("Machine for job %s is Offline. Rescheduling", leet_job.id)
-                next_exec = datetime.datetime.now() + self._machine_update_interval
-                self._sched_machine.add_job(self._is_machine_ready, 'date', run_date=next_exec, args=[leet_job])
+                _MOD_LOGGER.debug("Machine for job %s is Offline. Queueing for refresh.", leet_job.id)
+                self._queue_offline_job(leet_job)
             else:
                 _MOD_LOGGER.debug("Job %s has been cancelled or timed out. Removing.", leet_job.id)
                 #TODO change job status in case it has not been cancelled. Timeout status?
-                self._queue.put((_LTControl.JOB_DONE, leet_job))
+                self._put_cmd(_LTControl.JOB_DONE, leet_job)
+
+    def _queue_offline_job(self, leet_job):
+        """Parks a job whose machine is offline until the next bulk refresh
+        of its backend.
+
+        The first job parked for a backend schedules the refresh; the jobs
+        that pile up until it fires ride the same batch, so each backend
+        gets a single bulk query per update interval no matter how many of
+        its machines are offline."""
+        backend_name = leet_job.machine.backend_name
+        with self._offline_lock:
+            batch = self._offline_jobs.get(backend_name)
+            if batch is None:
+                self._offline_jobs[backend_name] = [leet_job]
+                self._sched.schedule(self._machine_update_interval, self._refresh_offline_batch, backend_name)
+            else:
+                batch.append(leet_job)
+
+    def _refresh_offline_batch(self, backend_name):
+        """Callback of the scheduler. Pushes the bulk refresh to the
+        backend's pool, so the server round trip doesn't stall the scheduler."""
+        job = self._session_pool.submit(self._poll_offline_batch, backend_name)
+        job.add_done_callback(self._handle_errors)
+
+    def _poll_offline_batch(self, backend_name):
+        """Refreshes every machine parked for a backend with a single bulk
+        call and re-checks the readiness of their jobs."""
+        with self._offline_lock:
+            batch = self._offline_jobs.pop(backend_name, None)
+        if not batch:
+            return
+
+        backend, _ = self._backend_list[backend_name]
+        backend.refresh_machines([leet_job.machine for leet_job in batch])
+        for leet_job in batch:
+            self._is_machine_ready(leet_job)
 
     def schedule_jobs(self, plugin, hostnames):
         """Main interface between the UI and the class. It receives the list
@@ -392,55 +768,60 @@ class Leet(threading.Thread):
         """
         #TODO remove
         #plugin.check_param()
-        search_request = LeetSearchRequest(hostnames, plugin)
+        #the backend count is fixed once started, set at construction so the
+        #dispatch path doesn't mutate the request
+        search_request = LeetSearchRequest(hostnames, plugin, self._backend_quantity)
         _MOD_LOGGER.debug("Scheduling jobs for %i machines", len(hostnames))
-        self._queue.put((_LTControl.SEARCH_BACKEND, search_request))
+        self._put_cmd(_LTControl.SEARCH_BACKEND, search_request)
 
     def cancel_job(self, job):
         """Cancel a job.
 
+        Jobs that already reached a terminal status are skipped, so no
+        useless message is put on the control queue.
+
         Args:
             job (LeetJob): A instance of LeetJob that will be cancelled.
         """
-        pass
-        # self._queue.put((_LTControl.CANCEL_JOB, job))
+        if job.status in _TERMINAL_JOB_STATUS:
+            return
+        self._put_cmd(_LTControl.CANCEL_JOB, job)
 
     def cancel_by_id(self, job_id):
         """Cancel a job by id.
 
         Args:
-            job_id (UUID): The ID of the job that should be cancelled.
+            job_id (int): The ID of the job that should be cancelled.
 
         Raises:
             KeyError: In case the ID does not exists
         """
-        pass
-        #TODO replace error for LeetError?
-        # self.cancel_job(self._job_list[job_id])
+        with self._job_list_lock:
+            job = self._job_list[job_id]
+        self.cancel_job(job)
 
     def cancel_all_jobs(self):
-        """Cancel all jobs."""
-        pass
-        # for job in self._job_list:
-        #     self.cancel_job(job)
+        """Cancel all jobs that have not finished yet."""
+        #a single control message; the main thread walks the list itself
+        self._put_cmd(_LTControl.CANCEL_ALL, None)
 
     def _stop_schedulers(self):
-        _MOD_LOGGER.debug("Closing scheduler threads...")
-        if self._sched_machine.state != APS_SCHED_STOPPED:
-            self._sched_machine.shutdown()
-        if self._sched_search.state != APS_SCHED_STOPPED:
-            self._sched_search.shutdown()
+        _MOD_LOGGER.debug("Closing scheduler thread...")
+        self._sched.shutdown()
 
     def shutdown(self):
         """Stop the execution of Leet and free all the resources, including the
         backend resources."""
         self._stop_schedulers()
-        self._queue.put((_LTControl.STOP, None))
+        #the flag goes up before the STOP command, so the main loop bails on
+        #its next batch even if other messages are queued ahead
+        self._shutting_down.set()
+        self._put_cmd(_LTControl.STOP, None)
 
         # if self.ready:
         #     self.ready = False
         #     _MOD_LOGGER.debug("Requesting all threads to close")
-        #     self._queue.put((_LTControl.STOP, None))
+        #     self._put_cmd(_LTControl.STOP, None)
         #     _MOD_LOGGER.debug("Closing backend threads")
         #     for backend, thread_pool in self._backend_list.values():
         #         backend.shutdown()
@@ -10,15 +10,29 @@ This module contains the three necessary classes to implement the CB backend:
 """
 import logging
 import datetime
+import time
+import shutil
+import concurrent.futures
 
 from cbapi.response import CbResponseAPI, Sensor
 import cbapi.errors
+from urllib3.util.retry import Retry
 
 from ..base import LeetBackend, LeetMachine, LeetSOType, LeetSession, LeetFileAttributes
 from ..errors import LeetSessionError, LeetCommandError
 
 _MOD_LOGGER = logging.getLogger(__name__)
 
+#timestamps from CB are seconds since the epoch in UTC. Adding a timedelta
+#to a precomputed epoch is a single C call and keeps the naive UTC datetimes
+#the rest of the code expects, without the deprecated utcfromtimestamp
+_EPOCH = datetime.datetime(1970, 1, 1)
+_timedelta = datetime.timedelta
+
+def _utc_datetime(timestamp):
+    """Converts an epoch timestamp from CB to a naive UTC datetime."""
+    return _EPOCH + _timedelta(seconds=timestamp)
+
 class CBMachine(LeetMachine):
     """A LeetMachine implementation for the CB Backend.
 
@@ -37,18 +51,30 @@ class CBMachine(LeetMachine):
         """
         super().__init__(hostname, backend_name)
         self.sensor = sensor
+        #(status, monotonic timestamp) of the last sensor read, so repeated
+        #can_connect checks don't each cost a server round trip
+        self._status_cache = (sensor.status, time.monotonic())
 
         if self.sensor.os_type == 1:
             self.so_type = LeetSOType.WINDOWS
 
+    #how long, in seconds, a sensor status read is trusted
+    _STATUS_TTL = 5.0
+
     @property
     def can_connect(self):
         """If the machine is available to be connected."""
-        return True if self.sensor.status == "Online" else False
+        status, timestamp = self._status_cache
+        if time.monotonic() - timestamp > self._STATUS_TTL:
+            self.refresh()
+            status = self._status_cache[0]
+
+        return status == "Online"
 
     def refresh(self):
         """See base class documentation"""
         self.sensor.refresh()
+        self._status_cache = (self.sensor.status, time.monotonic())
 
     def connect(self):
         """See base class documentation"""
@@ -79,38 +105,101 @@ class CBSession(LeetSession):
         """
         super().__init__(lr_session, machine_info)
 
-        self._mapping_table = {
-            "list_processes" : self.raw_session.list_processes,
-            "get_file" : self.raw_session.get_file,
-            "put_file" : self.raw_session.put_file,
-            "delete_file" : self.raw_session.delete_file,
-            "start_process" : self.raw_session.create_process,
-            "make_dir" : self.raw_session.create_directory,
-            "dir_list" : self.raw_session.list_directory
-            }
+        #caches directory listings by parent path for the session lifetime,
+        #so repeated existence checks don't hit the wire. Mutating methods
+        #invalidate the affected parent
+        self._dir_cache = {}
+        #memoizes attribute-list translations, see _parse_file_attributes
+        self._attr_cache = {}
+
+    #maps command names to the cbapi live response method names. Built once
+    #at class level, sessions resolve the bound method on demand
+    _COMMAND_TABLE = {
+        "list_processes" : "list_processes",
+        "get_file" : "get_file",
+        "put_file" : "put_file",
+        "delete_file" : "delete_file",
+        "start_process" : "create_process",
+        "make_dir" : "create_directory",
+        "dir_list" : "list_directory"
+        }
+
+    def _parent_path(self, remote_path):
+        """Path of the directory that holds 'remote_path', with a trailing
+        separator."""
+        #rpartition splits in one C pass, no list of components is built
+        head = remote_path.rstrip(self.path_separator).rpartition(self.path_separator)[0]
+        return head + self.path_separator
+
+    def _cached_dir(self, remote_path):
+        """Returns the entries of a directory keyed by filename, querying
+        the remote machine only on the first call. A path that can't be
+        listed is cached as empty."""
+        entries = self._dir_cache.get(remote_path)
+        if entries is None:
+            try:
+                list_dir = self._execute("dir_list", remote_path)
+            except LeetCommandError:
+                list_dir = ()
+            entries = {entry["filename"] : entry for entry in list_dir}
+            self._dir_cache[remote_path] = entries
+
+        return entries
+
+    def _invalidate_dir_cache(self, remote_path):
+        """Drops the cached listing of the directory holding 'remote_path',
+        called whenever the remote filesystem is changed."""
+        self._dir_cache.pop(self._parent_path(remote_path), None)
 
     def start_process(self, cmd_string, cwd=None, background=False):
         """See base class documentation"""
-        return self._execute("start_process", cmd_string, not background, None, cwd, 600, not background)
+        result = self._execute("start_process", cmd_string, not background, None, cwd, 600, not background)
+        #a process can write anywhere on the filesystem, so every cached
+        #listing is suspect after it runs. Plugins that poll exists() for
+        #process output depend on this
+        self._dir_cache.clear()
+
+        return result
 
     def delete_file(self, remote_file_path):
         """See base class documentation"""
         self._execute("delete_file", remote_file_path)
+        self._invalidate_dir_cache(remote_file_path)
 
     def put_file(self, fp, remote_file_path, overwrite=False):
         """See base class documentation"""
-        if self.exists(remote_file_path) and overwrite:
-            self._execute("delete_file", remote_file_path)
-
-        remote_path = self.path_separator.join(remote_file_path.split(self.path_separator)[:-1])
-        if not self.exists(remote_path):
+        #one listing of the parent answers both the overwrite branch and
+        #whether the directory chain has to be created
+        remote_path, _, file_name = remote_file_path.rpartition(self.path_separator)
+
+        entries = self._cached_dir(remote_path + self.path_separator)
+        if entries:
+            if file_name in entries and overwrite:
+                self.delete_file(remote_file_path)
+        else:
+            #empty can mean missing or actually empty; make_dir only creates
+            #what is really absent
             self.make_dir(remote_path)
 
         self._execute("put_file", fp, remote_file_path)
+        self._invalidate_dir_cache(remote_file_path)
 
     def make_dir(self, remote_path, recursive=True):
         """See base class documentation"""
-        path_parts = remote_path.split(self.path_separator)
+        if recursive:
+            #optimistically ask for the whole path in one command. If the
+            #endpoint refuses (a component already exists or can't be
+            #created) fall back to the prefix walk, which creates only the
+            #missing components
+            try:
+                self._execute("make_dir", remote_path)
+                self._invalidate_dir_cache(remote_path)
+                return
+            except LeetCommandError:
+                _MOD_LOGGER.debug("Single creation of path '%s' failed, walking the components", remote_path)
+
+        sep = self.path_separator
+        path_parts = remote_path.split(sep)
 
         #if the last split is empty, probably it was passed with trailling
         #separator
@@ -125,7 +214,9 @@ class CBSession(LeetSession):
         if recursive:
             for i, part in enumerate(path_parts):
                 check.append(part)
-                if not self.exists(self.path_separator.join(check)):
+                #membership on the cached listing, so walking a deep path
+                #costs one remote call per parent directory
+                if part not in self._cached_dir(sep.join(check[:-1]) + sep):
                     #the moment we can't find a path, we need to create everything
                     #from there forward
                     necessary_create = True
@@ -134,51 +225,64 @@ class CBSession(LeetSession):
                 check.pop(-1)
                 for missing_path in path_parts[i:]:
                     check.append(missing_path)
-                    path = self.path_separator.join(check)
+                    path = sep.join(check)
                     _MOD_LOGGER.debug("Trying to create path '%s' on the remote host", path)
                     self._execute("make_dir", path)
+                    self._invalidate_dir_cache(path)
             else:
                 _MOD_LOGGER.debug("No path need to be created.")
         else:
             self._execute("make_dir", remote_path)
+            self._invalidate_dir_cache(remote_path)
 
     def exists(self, remote_file_path):
         """See base class documentation"""
-        if remote_file_path[-1] == self.path_separator:
-            idx = -2
-        else:
-            idx = -1
-        split_path = remote_file_path.split(self.path_separator)
+        sep = self.path_separator
+        path, sep_found, file_name = remote_file_path.rstrip(sep).rpartition(sep)
         #passing a root path (c:, d:, /, etc) is a logic error and raises an
         #exception
-        if len(split_path) == 1:
+        if not sep_found:
             raise LeetCommandError("Can't verify existence of root paths.")
-        file_name = split_path[idx]
-        path = self.path_separator.join(split_path[:idx]) + self.path_separator
 
+        #always a fresh listing. Plugins poll this while waiting for the
+        #endpoint to produce output, so an answer from the session cache
+        #could never observe the change; the cache is reserved for the
+        #put_file/make_dir flows, which invalidate what they touch
         try:
-            list_dir = self._execute("dir_list", path)
-            #list_dir = self.raw_session.list_directory(path)
-        except LeetCommandError as e:
-        # except cbapi.live_response_api.LiveResponseError as e:
+            list_dir = self._execute("dir_list", path + sep)
+        except LeetCommandError:
             return False
 
-        return bool([a for a in list_dir if a["filename"] == file_name])
+        return any(entry["filename"] == file_name for entry in list_dir)
 
     def get_file(self, remote_file_path):
         """See base class documentation"""
         #TODO check if the file exist first?
         return self._execute("get_file", remote_file_path)
 
+    def get_file_streaming(self, remote_file_path, dest_fp):
+        """See base class documentation"""
+        _MOD_LOGGER.debug("Streaming remote file '%s'", remote_file_path)
+        try:
+            source = self.raw_session.get_raw_file(remote_file_path)
+        except cbapi.errors.TimeoutError as e:
+            raise LeetSessionError("Timed out when requesting a session to cbapi") from e
+        except cbapi.live_response_api.LiveResponseError as e:
+            raise LeetCommandError(str(e)) from e
+
+        #copied in 1MiB chunks, so memory usage doesn't depend on the size
+        #of the remote file
+        try:
+            shutil.copyfileobj(source, dest_fp, 1048576)
+        finally:
+            source.close()
+
     def _execute(self, *args):
         """See base class documentation"""
         #TODO should live response errors be mapped to plugin errors?
         _MOD_LOGGER.debug("Executing on session: %s", args)
         try:
-            if len(args) == 1:
-                return self._mapping_table[args[0]]()
-            else:
-                return self._mapping_table[args[0]](*args[1:])
+            return getattr(self.raw_session, self._COMMAND_TABLE[args[0]])(*args[1:])
         #TODO it can also raise ApiError on 404 to server?
         except cbapi.errors.TimeoutError as e:
             raise LeetSessionError("Timed out when requesting a session to cbapi") from e
@@ -189,15 +293,18 @@ class CBSession(LeetSession):
         #     raise LeetSessionError("Unknown function.", True) from e
 
     def _parse_file_attributes(self, attributes):
-        attr = []
-        attr_list = set(attributes)
-
-        if "HIDDEN" in attr_list:
-            attr.append(LeetFileAttributes.HIDDEN)
-        if "DIRECTORY" in attr_list:
-            attr.append(LeetFileAttributes.DIRECTORY)
-        if "SYSTEM" in attr_list:
-            attr.append(LeetFileAttributes.SYSTEM)
+        #the distinct attribute combinations on a filesystem are few, so the
+        #translation is memoized and a dict lookup replaces the membership
+        #tests for every repeated combination
+        key = frozenset(attributes)
+        attr = self._attr_cache.get(key)
+        if attr is None:
+            attr = tuple(leet_attr
+                         for name, leet_attr in (("HIDDEN", LeetFileAttributes.HIDDEN),
+                                                 ("DIRECTORY", LeetFileAttributes.DIRECTORY),
+                                                 ("SYSTEM", LeetFileAttributes.SYSTEM))
+                         if name in key)
+            self._attr_cache[key] = attr
 
         return attr
 
@@ -208,38 +315,39 @@ class CBSession(LeetSession):
         # {'last_access_time': 1515105722, 'last_write_time': 1515105722, 'filename': 'Boot', 'create_time': 1449789900, 'attributes': ['HIDDEN', 'SYSTEM', 'DIRECTORY'], 'size': 0},
         # {'last_access_time': 1515105722, 'last_write_time': 1290309831, 'filename': 'bootmgr', 'create_time': 1449789900, 'attributes': ['READONLY', 'HIDDEN', 'SYSTEM', 'ARCHIVE'], 'size': 383786},
         # {'last_access_time': 1247548136, 'last_write_time': 1247548136, 'filename': 'Documents and Settings', 'create_time': 1247548136, 'alt_name': 'DOCUME~1', 'attributes': ['HIDDEN', 'SYSTEM', 'DIRECTORY', 'REPARSE_POINT', 'NOT_CONTENT_INDEXED'], 'size': 0}
-        list_dir = []
         cb_list_dir = self._execute("dir_list", remote_path)
         if len(cb_list_dir) == 1 and "DIRECTORY" in cb_list_dir[0]["attributes"]:
             cb_list_dir = self._execute("dir_list", remote_path + self.path_separator)
 
-        for entry in cb_list_dir:
-            data = {"name": entry["filename"],
-                    "size": entry["size"],
-                    "attributes": self._parse_file_attributes(entry["attributes"]),
-                    "create_time": datetime.datetime.utcfromtimestamp(entry["create_time"]),
-                    "modification_time": datetime.datetime.utcfromtimestamp(entry["last_write_time"]),
-                    }
-            list_dir.append(data)
+        #bound once to locals, these lookups would otherwise repeat for
+        #every entry of the directory
+        parse_attributes = self._parse_file_attributes
+        utc_datetime = _utc_datetime
 
-        return list_dir
+        return [{"name": entry["filename"],
+                 "size": entry["size"],
+                 "attributes": parse_attributes(entry["attributes"]),
+                 "create_time": utc_datetime(entry["create_time"]),
+                 "modification_time": utc_datetime(entry["last_write_time"]),
+                 }
+                for entry in cb_list_dir]
 
     def list_processes(self):
         """See base class documentation"""
-        processes = []
-
         process_list = self._execute("list_processes")
-
-        for process in process_list:
-            processes.append({"username": process["username"],
-                              "pid": process["pid"],
-                              "ppid": process["parent"],
-                              "start_time": datetime.datetime.utcfromtimestamp(process["create_time"]),
-                              "command_line": process["command_line"].split(self.path_separator)[-1],
-                              "path": process["path"],
-                              })
-
-        return processes
+        #bound once to locals; these lookups would otherwise repeat for
+        #every process on the machine
+        utc_datetime = _utc_datetime
+        sep = self.path_separator
+
+        return [{"username": process["username"],
+                 "pid": process["pid"],
+                 "ppid": process["parent"],
+                 "start_time": utc_datetime(process["create_time"]),
+                 "command_line": process["command_line"].rpartition(sep)[2],
+                 "path": process["path"],
+                 }
+                for process in process_list]
 
     def __enter__(self):
         """Enter context"""
@@ -265,6 +373,10 @@ class Backend(LeetBackend):
         super().__init__("CB-" + profile_name, 7) #TODO move max_session to a configuration/variable
         self._profile_name = profile_name
         self._cb = None
+        #maps lowercased hostname to (sensor or None, monotonic timestamp),
+        #so overlapping searches don't re-pay the server query. Hostnames
+        #with no sensor are cached too, with a shorter TTL
+        self._sensor_cache = {}
 
     @property
     def url(self):
@@ -276,40 +388,134 @@ class Backend(LeetBackend):
         start the connection to the CB server.
         """
         super().start()
-        self._cb = CbResponseAPI(profile=self._profile_name)
+        #a bigger connection pool allows the concurrent sessions to reuse
+        #the same TCP/TLS connections instead of handshaking on every call,
+        #and transient server/connection errors are retried with backoff
+        self._cb = CbResponseAPI(profile=self._profile_name,
+                                 pool_connections=4,
+                                 pool_maxsize=2 * self.max_sessions,
+                                 max_retries=Retry(total=3, backoff_factor=0.3))
 
         return self
 
-    def _get_sensor(self, hostname):
-        """Return the sensor related to the hostname. If more than one sensor
-        is found, it will return the one that did the most recent check-in.
+    def shutdown(self):
+        """Stops the backend thread and closes the pooled connections to the
+        server (see base class documentation)."""
+        super().shutdown()
+        if self._cb is not None:
+            #BaseAPI.session is the cbapi Connection; its 'session' attribute
+            #is the underlying requests.Session holding the pool
+            self._cb.session.session.close()
 
-        Args:
-            hostname (str): The machine name
+    #how long, in seconds, a sensor lookup is trusted. Lookups that found
+    #no sensor expire faster, so newly installed sensors show up quickly
+    _SENSOR_CACHE_TTL = 30.0
+    _SENSOR_NEG_TTL = 5.0
+
+    def _cached_sensor(self, hostname):
+        """Checks the sensor cache for a hostname.
 
         Returns:
-            [Sensor]: The list of sensors
+            tuple (bool, Sensor): If the first member is True the lookup
+                was cached; the second member is the sensor, which can be
+                None for a hostname known to have no sensor.
         """
+        entry = self._sensor_cache.get(hostname.lower())
+        if entry is not None:
+            sensor, timestamp = entry
+            ttl = self._SENSOR_CACHE_TTL if sensor is not None else self._SENSOR_NEG_TTL
+            if time.monotonic() - timestamp <= ttl:
+                return True, sensor
+
+        return False, None
+
+    def _query_sensor(self, hostname):
+        """Issues one sensor query for a hostname and returns the sensor
+        with the most recent check-in, or None if the hostname is unknown.
+
+        The sensor API only filters on a single field value, so hostnames
+        can't be combined into one query; '_get_sensors_bulk' fans these
+        out over an executor to keep the round trips concurrent."""
         recent_sensor = None
-        query = "hostname:" + hostname
-        sensors = self._cb.select(Sensor).where(query)
 
-        for sensor in sensors:
-            if recent_sensor is None:
+        for sensor in self._cb.select(Sensor).where("hostname:" + hostname):
+            if recent_sensor is None or sensor.last_checkin_time > recent_sensor.last_checkin_time:
                 recent_sensor = sensor
-            else:
-                if sensor.last_checkin_time > recent_sensor.last_checkin_time:
-                    recent_sensor = sensor
 
         return recent_sensor
 
+    def _get_sensors_bulk(self, hostnames):
+        """Returns the sensors of a group of hostnames.
+
+        Each hostname costs one query, but the queries are issued in
+        parallel over the pooled connections. Hostnames with a fresh entry
+        in the sensor cache are answered from it without a query. If a
+        hostname has more than one sensor, the one with the most recent
+        check-in wins.
+
+        Args:
+            hostnames (list of str): The machine names
+
+        Returns:
+            dict: Maps each found hostname to its Sensor
+        """
+        sensors = {}
+        misses = []
+
+        for hostname in hostnames:
+            hit, cached = self._cached_sensor(hostname)
+            if not hit:
+                misses.append(hostname)
+            elif cached is not None:
+                sensors[hostname] = cached
+
+        if not misses:
+            return sensors
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_sessions, len(misses)), thread_name_prefix="Thr-" + self.backend_name + "-search") as executor:
+            found = dict(zip(misses, executor.map(self._query_sensor, misses)))
+
+        #cache the results, including the hostnames that came back empty
+        now = time.monotonic()
+        for hostname in misses:
+            sensor = found[hostname]
+            self._sensor_cache[hostname.lower()] = (sensor, now)
+            if sensor is not None:
+                sensors[hostname] = sensor
+
+        return sensors
+
+    def _refresh_machine(self, machine):
+        """Refreshes one machine, keeping its old sensor data if the server
+        can't answer. A failed refresh must not take the rest of the batch
+        down with it, so the error is only logged."""
+        try:
+            machine.refresh()
+        except cbapi.errors.ApiError as e:
+            _MOD_LOGGER.warning("Could not refresh sensor for '%s': %s", machine.hostname, str(e))
+
+    def refresh_machines(self, machines):
+        """Refreshes the sensor data of a group of machines.
+
+        The sensor API has no way of fetching several sensors in one query,
+        so each machine still costs a round trip, but they are issued in
+        parallel over the pooled connections instead of one after the other.
+        A machine whose refresh fails keeps its old data.
+
+        Args:
+            machines (list of CBMachine): The machines to be refreshed
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_sessions, len(machines)), thread_name_prefix="Thr-" + self.backend_name + "-refresh") as executor:
+            for _ in executor.map(self._refresh_machine, machines):
+                pass
+
     def _search_machines(self, search_request):
         """See base class documentation"""
-        machine_list = []
+        hostnames = list(search_request.hostnames)
+        if not hostnames:
+            return []
 
-        for hostname in search_request.hostnames:
-            sensor = self._get_sensor(hostname)
-            if sensor is not None:
-                machine_list.append(CBMachine(hostname, self.backend_name, sensor))
+        sensors = self._get_sensors_bulk(hostnames)
 
-        return machine_list
+        return [CBMachine(hostname, self.backend_name, sensor)
+                for hostname, sensor in sensors.items()]
@@ -5,6 +5,7 @@ import abc
 import threading
 import queue
 import datetime
+import time
 import logging
 import argparse
 
@@ -12,9 +13,12 @@ _MOD_LOGGER = logging.getLogger(__name__)
 
 from .errors import LeetPluginError, LeetError
 
-class LeetJobStatus(enum.Enum):
+class LeetJobStatus(enum.IntEnum):
     '''Flags the status of an individual job.
 
+    An IntEnum, so status comparisons and hashing run as plain integer
+    operations instead of going through Enum method dispatch.
+
     How are the states supposed to flow:
     PENDING -> EXECUTING, CANCELLED, ERROR
     EXECUTING -> COMPLETED, CANCELLED, ERROR, PENDING
@@ -168,6 +172,23 @@ class LeetSession(metaclass=abc.ABCMeta):
         """
         #TODO should we require the session backend returns any file, including locked ones?
 
+    def get_file_streaming(self, remote_file_path, dest_fp):
+        """Copies the contents of a remote file into a file-like object.
+
+        Backends that can stream the transfer should override this, keeping
+        the memory usage independent of the file size. This default loads
+        the whole file via 'get_file' before writing it.
+
+        Args:
+            remote_file_path (str): The absolute path on the remote machine.
+            dest_fp (file like object): Where the contents will be written,
+                opened as binary
+
+        Returns:
+            None
+        """
+        dest_fp.write(self.get_file(remote_file_path))
+
     @abc.abstractmethod
     def put_file(self, fp, remote_file_path, overwrite):
         """Transfer a file to the remote machine.
@@ -294,7 +315,7 @@ class LeetSearchRequest():
             created
         end_time (datetime.datetime): The time, in UTC, when the search was
             finished
-        hostnames (list of str): A list of hostnames the backends will look for
+        hostnames (frozenset of str): The hostnames the backends will look for
         plugin (LeetPlugin*): An instance of the LeetPlugin that will be executed
             on the machines
         ready (bool): A boolean that tells if the search is finished or not
@@ -313,20 +334,23 @@ class LeetSearchRequest():
         self.id = uuid.uuid4()
         self.start_time = datetime.datetime.utcnow()
         self.end_time = None
-        self.hostnames = hostnames
+        #a frozenset deduplicates the request and makes the "what was not
+        #found" check a set difference
+        self.hostnames = frozenset(hostnames)
         self.plugin = plugin
         self.ready = False
 
         self.backend_quantity = backend_numbers
 
         #we can have any number of threads adding machines or setting themselves
-        #as completed, lock to control all
+        #as completed, lock to control all. Neither critical section
+        #re-enters, so plain locks are enough
         self._completed_backends = set()
-        self._change_lock = threading.RLock()
+        self._change_lock = threading.Lock()
 
         self._found_machines = []
         #TODO do we need two locks?
-        self._machine_lock = threading.RLock()
+        self._machine_lock = threading.Lock()
 
     @property
     def found_machines(self):
@@ -381,54 +405,77 @@ class LeetSearchRequest():
                 f'completed_backends={self._completed_backends})'
                )
 
+class _Trig(enum.IntEnum):
+    """Triggers of the job state machine. Interned as small ints so a
+    transition lookup hashes a single integer instead of allocating and
+    hashing a (state, trigger string) tuple."""
+    PENDING = 0x0
+    EXECUTING = 0x1
+    CANCEL = 0x2
+    COMPLETED = 0x3
+    ERROR = 0x4
+
+def _build_transition_table():
+    """Builds the job transition table as a nested tuple, indexed by
+    [state value][trigger value] and holding the destination state, or None
+    for an invalid transition. Tuple indexing skips the hashing a dict
+    lookup would pay on every transition.
+    """
+    # two special cases of note:
+    #   pending to pending -> a job can go from pending to pending, by itself,
+    #       it is already in the state so there is no issue
+    #   cancelled receiving executing keeps in the same state:
+    #       if a job has been cancelled while LEET is trying to connect, it
+    #       is a waste to just drop the connection, as such, we keep in cancelled
+    #       and if the job is successful, just move it to finished.
+    #TODO I don't like the last statement
+    spec = {
+        (LeetJobStatus.PENDING, _Trig.PENDING) : LeetJobStatus.PENDING,
+        (LeetJobStatus.PENDING, _Trig.EXECUTING) : LeetJobStatus.EXECUTING,
+        (LeetJobStatus.PENDING, _Trig.CANCEL) : LeetJobStatus.CANCELLED,
+        (LeetJobStatus.PENDING, _Trig.ERROR) : LeetJobStatus.ERROR,
+        (LeetJobStatus.EXECUTING, _Trig.PENDING) : LeetJobStatus.PENDING,
+        (LeetJobStatus.EXECUTING, _Trig.CANCEL) : LeetJobStatus.CANCELLED,
+        (LeetJobStatus.EXECUTING, _Trig.COMPLETED) : LeetJobStatus.COMPLETED,
+        (LeetJobStatus.EXECUTING, _Trig.ERROR) : LeetJobStatus.ERROR,
+        (LeetJobStatus.CANCELLED, _Trig.COMPLETED) : LeetJobStatus.COMPLETED,
+        (LeetJobStatus.CANCELLED, _Trig.EXECUTING) : LeetJobStatus.CANCELLED,
+        }
+
+    return tuple(tuple(spec.get((state, trig)) for trig in _Trig)
+                 for state in LeetJobStatus)
+
 class _JobFSM():
     """A very, very, very simplified state machine used to control how a job
     status can change. The machine is simple enough that it can be used by
     different types of variables, but as this should be used only internally
     for LEET, so we can define the expected types.
 
+    The transition table is the same for every job, following what is
+    documented in LeetJobStatus, so it is built once at class level and
+    shared. Each instance carries only its current state.
+
     Attributes:
         current_state (LeetJobStatus): Indicates what is the current status of the job
     """
+    __slots__ = ("current_state", "_t_lock")
 
-    def __init__(self, transitions_table, initial):
-        """Creates a new _JobFSM() object. The transition table is a list of dicts
-        that contains the source state, the destination state and a trigger.
+    _TRANSITIONS = _build_transition_table()
+
+    def __init__(self, initial):
+        """Creates a new _JobFSM() object using the shared transition table.
 
         Args:
-            transitions_table (list of dict): Each entry in the list has to be a dict
-                with the keys 'source', 'trigger' and 'dest'. The type of values of 'source'
-                and 'dest' must be the same and, in this case, LeetJobStatus.
-                The format is mandatory.
             initial (LeetJobStatus): The initial state of the FSM
 
         Returns:
-            _JobFSM: New object using with the correct transition table
+            _JobFSM: New object
         """
-        self._transitions = {}
         self.current_state = initial
-        #this lock controls the change of status by the machine
-        self._t_lock = threading.RLock()
-
-        self._process_transitions(transitions_table)
-
-    def _process_transitions(self, transitions_table):
-        """Process the provided transition table so it is better used by
-        the class. Effectively, it changes the format from:
-
-            [{"source": source_state, "trigger": "trigger_name", "dest": dest_state},
-            {"source": source_state, "trigger": "trigger_name", "dest": dest_state},
-            ...]
-
-        to a dictionary:
-            {(source_state, "trigger_name"): dest_state,
-            (source_state, "trigger_name"): dest_state,
-            ...}
-
-        This information is stored and used to move between states.
-        """
-        for t in transitions_table:
-            self._transitions[(t["source"], t["trigger"])] = t["dest"]
+        #transitions come from the Leet thread (cancellation) and from the
+        #session pool workers (execution results), so the read-modify-write
+        #state swap has to be serialized
+        self._t_lock = threading.Lock()
 
     def next(self, condition):
         """Function used to transition between machine states. The condition HAS
@@ -436,20 +483,18 @@ class _JobFSM():
         has to be valid and return True
 
         Args:
-            condition (str): The condition that happened to change the trigger.
+            condition (_Trig): The condition that happened to change the trigger.
 
         Raises:
             LeetError: If there is a condition that has not been registered. Basically,
                 if there is an attempt to move from a valid state, without the right
                 trigger.
         """
-        try:
-            self._t_lock.acquire()
-            self.current_state = self._transitions[(self.current_state, condition)]
-        except KeyError as e:
-            raise LeetError(f"Invalid transition from {self.current_state} with trigger {condition}") from e
-        finally:
-            self._t_lock.release()
+        with self._t_lock:
+            next_state = self._TRANSITIONS[self.current_state.value][condition]
+            if next_state is None:
+                raise LeetError(f"Invalid transition from {self.current_state!r} with trigger {condition!r}")
+            self.current_state = next_state
 
 class LeetJob():
     """Class that represents a Job in LEET. It creates a unique, random, identifier for the
@@ -457,12 +502,17 @@ class LeetJob():
     of the plugin and state of the job.
 
     Attributes:
-        id (UUID): ID of the job. Should not be manually set or changed at any point
+        id (int): ID of the job. Should not be manually set or changed at any point
         machine (string): The name of the machine where the plugin will be executed
         plugin_result (PluginResult): Where the result of the plugin execution will
             be stored
         plugin_instance (PluginBase*): An instance of any class that implements 'PluginBase'.
     """
+    #_session_limit is set by Leet when the job is accepted, holding the
+    #session semaphore of the backend the job belongs to
+    __slots__ = ("id", "machine", "start_time", "start_monotonic",
+                 "plugin_result", "plugin_instance", "_status_machine",
+                 "transition", "_session_limit")
 
     def __init__(self, machine, plugin_instance):
         """Creates a new LeetJob() object. Receives the name of the host and the
@@ -475,56 +525,34 @@ class LeetJob():
         Returns:
             LeetJob: New object representing the job.
         """
-        self.id = uuid.uuid4()
+        #the raw 128-bit integer keeps the global uniqueness of a UUID, but
+        #comparisons and hashing work on a plain int and the UUID object
+        #itself is not kept alive for every job
+        self.id = uuid.uuid4().int
         self.machine = machine
         self.start_time = datetime.datetime.utcnow()
+        #monotonic counterpart of start_time, used for expiry math, immune
+        #to wall-clock adjustments
+        self.start_monotonic = time.monotonic()
         self.plugin_result = None
         self.plugin_instance = plugin_instance
-        self._status_machine = None
-
-        self._conf_status_machine()
+        self._status_machine = _JobFSM(LeetJobStatus.PENDING)
+        #bound once, so hot callers can transition with a single call frame
+        #instead of going through the named wrapper methods
+        self.transition = self._status_machine.next
 
     @property
     def status(self):
         """Status of the job"""
         return self._status_machine.current_state
 
-    def _conf_status_machine(self):
-        """Defines the transaction table of all the jobs.
-
-        It follows what is documented in LeetJobStatus documentation.
-        """
-        #TODO having a machine per job is wasteful. It is the same machine for all jobs,
-        #replace this for a single machine for all jobs.
-        # two special cases of note:
-        #   pending to pending -> a job can go from pending to pending, by itself,
-        #       it is already in the state so there is no issue
-        #   cancelled receiving executin keeps in the same state:
-        #       if a job has been cancelled while LEET is trying to connect, it
-        #       is a waste to just drop the connection, as such, we keep in cancelled
-        #       and if the job is successful, just move it to finished.
-        #TODO I don't like the last statement
-        t = [
-            {"trigger" : "pending", "source" : LeetJobStatus.PENDING, "dest" : LeetJobStatus.PENDING},
-            {"trigger" : "executing", "source" : LeetJobStatus.PENDING, "dest" : LeetJobStatus.EXECUTING},
-            {"trigger" : "cancel", "source" : LeetJobStatus.PENDING, "dest" : LeetJobStatus.CANCELLED},
-            {"trigger" : "pending", "source" : LeetJobStatus.EXECUTING, "dest" : LeetJobStatus.PENDING},
-            {"trigger" : "cancel", "source" : LeetJobStatus.EXECUTING, "dest" : LeetJobStatus.CANCELLED},
-            {"trigger" : "completed", "source" : LeetJobStatus.EXECUTING, "dest" : LeetJobStatus.COMPLETED},
-            {"trigger" : "completed", "source" : LeetJobStatus.CANCELLED, "dest" : LeetJobStatus.COMPLETED},
-            {"trigger" : "executing", "source" : LeetJobStatus.CANCELLED, "dest" : LeetJobStatus.CANCELLED},
-            {"trigger" : "error", "source" : LeetJobStatus.EXECUTING, "dest" : LeetJobStatus.ERROR},
-            {"trigger" : "error", "source" : LeetJobStatus.PENDING, "dest" : LeetJobStatus.ERROR}
-        ]
-        self._status_machine = _JobFSM(t, LeetJobStatus.PENDING)
-
     def pending(self):
         """Change the job status to pending.
 
         Raises:
             LeetError: If the job can't be moved into this state.
         """
-        self._status_machine.next("pending")
+        self.transition(_Trig.PENDING)
 
     def executing(self):
         """Change the job status to executing.
@@ -532,7 +560,7 @@ class LeetJob():
         Raises:
             LeetError: If the job can't be moved into this state.
         """
-        self._status_machine.next("executing")
+        self.transition(_Trig.EXECUTING)
 
     def cancel(self):
         """Change the job status to cancelled.
@@ -540,7 +568,7 @@ class LeetJob():
         Raises:
             LeetError: If the job can't be moved into this state.
         """
-        self._status_machine.next("cancel")
+        self.transition(_Trig.CANCEL)
 
     def completed(self):
         """Change the job status to completed.
@@ -548,7 +576,7 @@ class LeetJob():
         Raises:
             LeetError: If the job can't be moved into this state.
         """
-        self._status_machine.next("completed")
+        self.transition(_Trig.COMPLETED)
 
     def error(self):
         """Change the job status to error.
@@ -556,7 +584,7 @@ class LeetJob():
         Raises:
             LeetError: If the job can't be moved into this state.
         """
-        self._status_machine.next("error")
+        self.transition(_Trig.ERROR)
 
     def __eq__(self, other):
         if isinstance(other, LeetJob):
@@ -612,7 +640,21 @@ class LeetBackend(metaclass=abc.ABCMeta):
         #change this to to a threadpool?
         self._monitor_thread = threading.Thread(target=self._monitor_queue, name="Thr-" + backend_name)
         self._queue = queue.Queue()
-        self.leet = None
+        self._leet = None
+        self._notify_search = None
+
+    @property
+    def leet(self):
+        """A "pointer" to the main Leet class, allowing the backend to inform
+        it of things it has done."""
+        return self._leet
+
+    @leet.setter
+    def leet(self, value):
+        self._leet = value
+        #the completion callable is bound once here, so the monitor loop
+        #notifies without re-resolving the method on every search
+        self._notify_search = value.notify_search_completed if value is not None else None
 
     def start(self):
         """Start the backend thread and resources.
@@ -633,6 +675,18 @@ class LeetBackend(metaclass=abc.ABCMeta):
         self._queue.put((_BackendControl.STOP, None))
         self._monitor_thread.join()
 
+    def refresh_machines(self, machines):
+        """Refreshes the status of a group of machines.
+
+        Backends that can batch the operation with the server should
+        override this; the default refreshes one machine at a time.
+
+        Args:
+            machines (list of LeetMachine*): The machines to be refreshed
+        """
+        for machine in machines:
+            machine.refresh()
+
     def search_machines(self, search_request):
         """Search for a group of machines on the backend.
 
@@ -661,7 +715,7 @@ class LeetBackend(metaclass=abc.ABCMeta):
                 _MOD_LOGGER.debug("Backend '%s' has finished searching.", self.backend_name)
                 if search_request.ready:
                     _MOD_LOGGER.debug("Search is ready, sending notification")
-                    self.leet.notify_search_completed(search_request)
+                    self._notify_search(search_request)
             else:
                 raise LeetError("'%s' is not a valid internal code", code)
 
@@ -728,7 +782,8 @@ class PluginBase(metaclass=abc.ABCMeta):
         """
         self.arg_parser = LeetPluginParser(prog=self.LEET_PG_NAME, add_help=False)
         self.args = None
-        #self._ltpg_param = {}
+        #caches the formatted help text, see get_help
+        self._help_cache = None
 
     def parse_parameters(self, args):
         self.args = self.arg_parser.parse_args(args)
@@ -736,15 +791,22 @@ class PluginBase(metaclass=abc.ABCMeta):
     def get_help(self):
         """Returns a plugin help text based on description and parameters.
 
+        The text is built on the first call and cached, as the arguments of
+        a plugin don't change after its definition and interfaces tend to
+        request the help repeatedly.
+
         Returns:
             str: A string containing the help of the plugin
         """
+        if self._help_cache is not None:
+            return self._help_cache
+
         header = [self.LEET_PG_DESCRIPTION, "=" * 40]
         help_msg = self.arg_parser.format_help()
         help_msg = help_msg.split(" ", 1)[1].replace("optional arguments:", "").split("\n")
-        help_msg = "\n".join(header + [a for a in help_msg if a])
+        self._help_cache = "\n".join(header + [a for a in help_msg if a])
 
-        return help_msg
+        return self._help_cache
 
     def get_plugin_parameters(self):
         """Returns all the parameters of a plugin.
@@ -785,5 +847,5 @@ class PluginBase(metaclass=abc.ABCMeta):
         'Return a nicely formatted representation string'
         return (f'{self.__class__.__name__}(name={self.LEET_PG_NAME}, '
                 f'description={self.LEET_PG_DESCRIPTION}, '
-                f'_ltpg_param={self._ltpg_param})'
+                f'args={self.args})'
                )
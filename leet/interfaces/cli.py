@@ -6,6 +6,7 @@ import cmd
 import shlex
 import threading
 import queue
+import collections
 import configparser
 import os
 import sys
@@ -32,7 +33,7 @@ def pretty_print(job):
     print(tabulate.tabulate(job.plugin_result, headers="keys"))
 
 def pretty_jobs_status(jobs):
-    """List of dicts containing 'id, hostname, status'"""
+    """List of JobStatusRow containing 'id, hostname, plugin, status'"""
     print(tabulate.tabulate(jobs, headers="keys"))
 
 def _find_cb_profiles():
@@ -73,7 +74,9 @@ class LeetTerminal(cmd.Cmd):
         self.backends = self._load_backends(cb_profiles)
 
         self._notify_thread = threading.Thread(target=self._wait_leet_notification, name="Thr-CLI-Notify")
-        self.finished_jobs = []
+        #deque appends are atomic, so the notification thread can add finished
+        #jobs while the terminal reads them, without a lock
+        self.finished_jobs = collections.deque()
         self._notified = False
 
         #TODO allow backend configuration and setting
@@ -124,11 +127,12 @@ class LeetTerminal(cmd.Cmd):
 
     def _wait_leet_notification(self):
         while True:
-            leet_job = self._notification_queue.get()
-            if leet_job is None:
+            leet_jobs = self._notification_queue.get()
+            if leet_jobs is None:
                 break
             else:
-                self.finished_jobs.append(leet_job)
+                #jobs finishing close together arrive as a single list
+                self.finished_jobs.extend(leet_jobs)
                 if not self._notified:
                     LeetTerminal.prompt = "! LEET> "
                     print("\nSomething finished. Use 'results' to get the results.")
@@ -254,8 +258,11 @@ class LeetTerminal(cmd.Cmd):
         LeetTerminal.prompt = "LEET> "
         self._notified = False
 
-        if self.finished_jobs:
-            for job in self.finished_jobs:
+        #snapshot first, a deque can't be iterated while the notification
+        #thread extends it
+        finished_jobs = list(self.finished_jobs)
+        if finished_jobs:
+            for job in finished_jobs:
                 pretty_print(job)
         else:
             print("***No jobs have been completed.")
@@ -264,11 +271,8 @@ class LeetTerminal(cmd.Cmd):
         """Shows a summary of the status of the jobs."""
         status = self._leet.job_status
 
-        for job in self.finished_jobs:
-            status.append({"id" : job.id,
-                           "hostname" : job.machine.hostname,
-                           "plugin": job.plugin_instance.LEET_PG_NAME,
-                           "status" : job.status})
+        for job in list(self.finished_jobs):
+            status.append(leet.api.JobStatusRow(job.id, job.machine.hostname, job.plugin_instance.LEET_PG_NAME, job.status.name))
         if status:
             pretty_jobs_status(status)
         else:
@@ -293,7 +297,7 @@ class LeetTerminal(cmd.Cmd):
         help plugin set
         help plugin 'plugin_name'
         """
-        options = ["list", "set"] + self._leet.plugin_list
+        options = ["list", "set"] + list(self._leet.plugin_list)
         if len(tokens) > 3 or tokens[2] not in options:
             print("***No help for ", " ".join(tokens))
             return
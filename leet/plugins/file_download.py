@@ -1,5 +1,6 @@
 import sys
 import os
+import stat
 
 from leet.base import PluginBase
 from leet.errors import LeetPluginError
@@ -45,10 +46,15 @@ class LeetPlugin(PluginBase):
         the remote filename and add that and will also prepend the machine name
         to the file, to guarantee uniqueness.
         """
-        if not os.path.exists(self.args.dest):
-            raise LeetPluginError("The local path does not exists.")
-
-        if os.path.isdir(self.args.dest):
+        #a single stat answers both the existence and the directory check.
+        #Any OSError (missing, permission, bad component) means the path is
+        #unusable, the same as the os.path.exists test it replaced
+        try:
+            dest_stat = os.stat(self.args.dest)
+        except OSError as e:
+            raise LeetPluginError("The local path does not exists or can't be accessed.") from e
+
+        if stat.S_ISDIR(dest_stat.st_mode):
             l_path = self.args.dest
             l_filename = "_".join([hostname, r_filename])
         else:
@@ -0,0 +1,163 @@
+import os
+import stat
+import time
+import random
+import hashlib
+import concurrent.futures
+
+from leet.base import PluginBase, LeetFileAttributes
+from leet.errors import LeetPluginError, LeetCommandError
+
+_MAX_DOWNLOAD_RETRIES = 5
+
+def _sleep_backoff(attempt):
+    """Sleeps exponentially longer on each attempt (capped at 60 seconds),
+    with a bit of jitter, so failing downloads don't hammer the sensor.
+    """
+    time.sleep(min(60, 2 ** attempt) + random.random())
+
+class _HashingWriter():
+    """Wraps a binary file object, updating a hash object and a byte count
+    with everything written through it."""
+    __slots__ = ("_fp", "_hasher", "written")
+
+    def __init__(self, fp, hasher):
+        self._fp = fp
+        self._hasher = hasher
+        self.written = 0
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.written += len(data)
+        return self._fp.write(data)
+
+class LeetPlugin(PluginBase):
+    LEET_PG_NAME = "get_collection"
+    LEET_PG_DESCRIPTION = "Download all parts of a collection archive from a remote directory."
+
+    def __init__(self):
+        super().__init__()
+        self.max_concurrent_downloads = 8
+
+        self.arg_parser.add_argument("--path", help="Absolute path of the directory on the remote endpoint where the collection is stored", required=True)
+        self.arg_parser.add_argument("--prefix", help="Download only the files that start with the prefix", default="")
+        self.arg_parser.add_argument("--dest", help="Absolute path of a local directory where the files will be saved. The machine name will be added to each file", required=True)
+
+    def _fix_local_dir(self):
+        """Makes sure the local destination exists and is a directory."""
+        #any OSError (missing, permission, bad component) means the path is
+        #unusable
+        try:
+            dest_stat = os.stat(self.args.dest)
+        except OSError as e:
+            raise LeetPluginError("The local path does not exists or can't be accessed.") from e
+        if not stat.S_ISDIR(dest_stat.st_mode):
+            raise LeetPluginError("The local path must be a directory.")
+
+        return self.args.dest
+
+    def _hash_local_file(self, dest_path):
+        """Computes the sha256 of a local file reading it in 1MiB chunks."""
+        sha256 = hashlib.sha256()
+
+        with open(dest_path, "rb") as file_input:
+            for chunk in iter(lambda: file_input.read(1048576), b""):
+                sha256.update(chunk)
+
+        return sha256.hexdigest()
+
+    def _verify_local_copy(self, dest_path, size):
+        """Checks if a previous download can be reused. The file has to have
+        the expected size and match the sha256 saved on its sidecar file.
+        """
+        try:
+            if os.path.getsize(dest_path) != size:
+                return False
+            with open(dest_path + ".sha256") as sidecar:
+                expected = sidecar.read().strip()
+        except OSError:
+            return False
+
+        return self._hash_local_file(dest_path) == expected
+
+    def _save_file(self, session, remote_file, dest_path):
+        """Saves a remote file locally and returns the number of bytes written.
+
+        The transfer goes through 'session.get_file_streaming', so the
+        memory usage is constant regardless of the size of the part and
+        backend errors surface as the usual Leet exceptions.
+
+        The sha256 of the content is computed while writing and saved to a
+        sidecar file, allowing future executions to verify the local copy
+        without downloading it again.
+        """
+        sha256 = hashlib.sha256()
+
+        #1MiB write buffer, so the streamed chunks coalesce into large writes
+        with open(dest_path, "wb", buffering=1048576) as file_output:
+            tee = _HashingWriter(file_output, sha256)
+            session.get_file_streaming(remote_file, tee)
+
+        with open(dest_path + ".sha256", "w") as sidecar:
+            sidecar.write(sha256.hexdigest())
+
+        return tee.written
+
+    def _download_entry(self, session, entry, dest_dir, hostname):
+        """Downloads a single file of the collection, skipping files that
+        have been fully downloaded before and retrying incomplete downloads.
+        """
+        #paths are computed once and reused across the retries
+        file_name = entry["name"]
+        size = entry["size"]
+        remote_path = self.args.path
+        if remote_path[-1] != session.path_separator:
+            remote_path += session.path_separator
+        remote_file = remote_path + file_name
+        dest_path = os.path.join(dest_dir, "_".join([hostname, file_name]))
+
+        if self._verify_local_copy(dest_path, size):
+            return {"src": remote_file,
+                    "dst": dest_path,
+                    "status": "skipped"}
+
+        for attempt in range(_MAX_DOWNLOAD_RETRIES):
+            try:
+                if self._save_file(session, remote_file, dest_path) == size:
+                    break
+            except LeetCommandError:
+                #transient command failure, back off and try again
+                pass
+            #no point backing off after the last attempt, just raise
+            if attempt + 1 < _MAX_DOWNLOAD_RETRIES:
+                _sleep_backoff(attempt)
+        else:
+            raise LeetPluginError(f"Could not download {file_name} after {_MAX_DOWNLOAD_RETRIES} attempts.")
+
+        return {"src": remote_file,
+                "dst": dest_path,
+                "status": "ok"}
+
+    def run(self, session, machine_info):
+        data = []
+
+        dest_dir = self._fix_local_dir()
+        dir_list = session.list_dir(self.args.path)
+        #filter built once, cheapest test first, lookups hoisted to locals
+        prefix = self.args.prefix
+        directory_attr = LeetFileAttributes.DIRECTORY
+        entries = [entry for entry in dir_list
+                   if entry["name"].startswith(prefix)
+                   and directory_attr not in entry["attributes"]]
+        if not entries:
+            raise LeetPluginError(f"No collection files found on {self.args.path}.")
+
+        #all downloads are submitted at once and the pool size caps how many
+        #requests hit the sensor simultaneously
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrent_downloads, thread_name_prefix="Thr-" + self.LEET_PG_NAME) as executor:
+            futures = [executor.submit(self._download_entry, session, entry, dest_dir, machine_info.hostname)
+                       for entry in entries]
+            for future in concurrent.futures.as_completed(futures):
+                data.append(future.result())
+
+        return data
@@ -20,7 +20,7 @@ setup(
          "Programming Language :: Python :: 3 :: Only",
          "Topic :: Security"
     ],
-    install_requires = ["tabulate", "cbapi", "apscheduler"],
+    install_requires = ["tabulate", "cbapi"],
     keywords = "leet edr",
     python_requires = ">=3.6",
     packages = find_packages(exclude=['contrib', 'docs', 'tests*']),